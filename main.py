@@ -7,35 +7,36 @@
 """Some demonstration code for querying a database and returning the results as a dataframe"""
 # ---------------------------------------------------------------------------
 
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from logging.config import dictConfig
 import time
 
+import pandas as pd
+
 from database_extractor import (
     load_config,
-    create_influxdb_client,
+    parse_time_string,
+    get_influxdb_client,
     DataExtractorQueryConfig,
-    query_database,
+    query_database_async,
+    query_database_by_day,
     query_data_for_day,
 )
 
 
 def setup_logging(filepath="config/logger.yaml"):
-    import yaml
     from pathlib import Path
 
-    if Path(filepath).exists():
-        with open(filepath, "r") as stream:
-            config = yaml.load(stream, Loader=yaml.FullLoader)
-    else:
-        raise FileNotFoundError
+    config = load_config(filepath)
     Path("logs/").mkdir(exist_ok=True)
     dictConfig(config)
 
 
 def main():
     start_time = datetime.now()
-    database_client = create_influxdb_client("config/.influxdb.toml")
+    database_client = get_influxdb_client("config/.influxdb.toml")
     previous_day = datetime(start_time.year, start_time.month, start_time.day) - timedelta(1)
     # For running a cronjob at midnight
     query_data_for_day(database_client, previous_day)
@@ -48,7 +49,7 @@ def main():
 
     # # Create a client to interact with the InfluxDB database
     # # Configuration is fetched from the .influxdb.toml file
-    # database_client = create_influxdb_client("config/.influxdb.toml")
+    # database_client = get_influxdb_client("config/.influxdb.toml")
 
     # # Create a query configuration object to parse the configuration file
     # query_config = DataExtractorQueryConfig(**application_config["query"])
@@ -69,7 +70,7 @@ def main():
 
     # # Do something with the result
     # # print(result.head(10))
-    # result.to_pickle("./influxdb_live_1.pkl")
+    # result.to_feather("./influxdb_live_1.arrow", compression="lz4")
 
 
 def generate_datetime_list(
@@ -84,17 +85,12 @@ def generate_datetime_list(
     :param date_format: The format in which to output the datetime strings.
     :return: A list of datetime strings in the specified format.
     """
-    start = datetime.strptime(start_date, date_format)
-    end = datetime.strptime(end_date, date_format)
-
-    current = start
-    datetimes = []
+    start = parse_time_string(start_date, date_format)
+    end = parse_time_string(end_date, date_format)
 
-    while current <= end:
-        datetimes.append(current.strftime(date_format))
-        current += delta
-
-    return datetimes
+    # The range is generated and formatted by pandas in compiled code
+    datetimes = pd.date_range(start=start, end=end, freq=delta)
+    return datetimes.strftime(date_format).tolist()
 
 
 def extract_date(datetime_str):
@@ -104,21 +100,20 @@ def extract_date(datetime_str):
     :param datetime_str: The datetime string.
     :return: The date part of the datetime string.
     """
-    dt = datetime.strptime(datetime_str, "%Y-%m-%dT%H:%M:%SZ")
-    date_str = dt.strftime("%Y-%m-%d")
-    return date_str
+    # The string is already ISO shaped, so the date is its first 10 characters
+    return datetime_str[:10]
 
 
 # Example usage:
 
 
-def batched_data():
+def batched_data(max_workers: int = 8):
     # Fetch application configuration from file
     application_config = load_config("config/application.toml")
 
     # Create a client to interact with the InfluxDB database
     # Configuration is fetched from the .influxdb.toml file
-    database_client = create_influxdb_client("config/.influxdb.toml")
+    database_client = get_influxdb_client("config/.influxdb.toml")
 
     # Create a query configuration object to parse the configuration file
     query_config = DataExtractorQueryConfig(**application_config["query"])
@@ -127,25 +122,105 @@ def batched_data():
     # Query midnight to midnight for each day
     start_date = "2024-02-01T00:00:00Z"
     end_date = "2024-06-01T00:00:00Z"
-    delta = timedelta(days=1, hours=0, minutes=0, seconds=0)  # Every 24 hours
+    # Each query covers several days, and is split into days once returned
+    days_per_query = 7
+    delta = timedelta(days=days_per_query)
 
-    query_datetimes_list: list[datetime] = generate_datetime_list(
+    query_datetimes_list: list[str] = generate_datetime_list(
         start_date, end_date, delta
     )
+    last_day = parse_time_string(end_date)
+
+    # The per-day time window is passed separately, and stretched by
+    # query_database_by_day into one continuous range covering every day of the query.
+    # It must therefore span exactly one day
+    delta_time_start = query_config.delta_time_start
+    delta_time_end = query_config.delta_time_end
+    query_kwargs = {
+        key: value
+        for key, value in query_config.items()
+        if key not in ("delta_time_start", "delta_time_end")
+    }
 
     # set smallest number of lines, to prevent saving near-empty files
     data_threshold = 20
 
-    # Query the database, and return a Pandas DataFrame object
-    for query_time in query_datetimes_list:
-        result = query_database(
+    def query_and_write(query_time):
+        # Query the database, and return a Pandas DataFrame object per day
+        results = query_database_by_day(
             client=database_client,
             query_time=query_time,
-            **query_config,
+            # The final query is truncated at the end date
+            days=min(
+                days_per_query, (last_day - parse_time_string(query_time)).days + 1
+            ),
+            delta_time_start=delta_time_start,
+            delta_time_end=delta_time_end,
+            **query_kwargs,
         )
-        if len(result) >= data_threshold:
-            result.to_csv(
-                f"out/prototype-zero_realtime-data_{extract_date(query_time)}.csv"
+        for day, result in results.items():
+            if len(result) >= data_threshold:
+                # Feather (Arrow IPC) keeps dtypes and is far cheaper to write than csv
+                result.to_feather(
+                    f"out/prototype-zero_realtime-data_{day:%Y-%m-%d}.arrow",
+                    compression="lz4",
+                )
+
+    # Queries are network bound, so they are dispatched concurrently to overlap
+    # the round-trip latency of each query. The client is shared between threads.
+    # Each worker writes its own results, so finished futures do not hold any data
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(query_and_write, query_time)
+            for query_time in query_datetimes_list
+        ]
+        for future in as_completed(futures):
+            future.result()
+
+
+async def batched_data_async():
+    # Fetch application configuration from file
+    application_config = load_config("config/application.toml")
+
+    # Create a client to interact with the InfluxDB database
+    # Configuration is fetched from the .influxdb.toml file
+    database_client = get_influxdb_client("config/.influxdb.toml")
+
+    # Create a query configuration object to parse the configuration file
+    query_config = DataExtractorQueryConfig(**application_config["query"])
+
+    # List of dates to query
+    # Query midnight to midnight for each day
+    start_date = "2024-02-01T00:00:00Z"
+    end_date = "2024-06-01T00:00:00Z"
+    delta = timedelta(days=1)
+
+    query_datetimes_list: list[str] = generate_datetime_list(
+        start_date, end_date, delta
+    )
+
+    # set smallest number of lines, to prevent saving near-empty files
+    data_threshold = 20
+
+    # Await all of the daily queries together, so their latency overlaps
+    with ThreadPoolExecutor(max_workers=min(32, len(query_datetimes_list))) as executor:
+        results = await asyncio.gather(
+            *[
+                query_database_async(
+                    client=database_client,
+                    query_time=query_time,
+                    executor=executor,
+                    **query_config,
+                )
+                for query_time in query_datetimes_list
+            ]
+        )
+
+    for query_time, result in zip(query_datetimes_list, results):
+        if result is not None and len(result) >= data_threshold:
+            result.to_feather(
+                f"out/prototype-zero_realtime-data_{extract_date(query_time)}.arrow",
+                compression="lz4",
             )
 
 
@@ -153,3 +228,4 @@ if __name__ == "__main__":
     setup_logging()
     main()
     # batched_data()
+    # asyncio.run(batched_data_async())
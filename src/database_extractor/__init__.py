@@ -4,10 +4,20 @@ __version__ = "0.1.2"
 from .database_extractor import (
     DeltaTime,
     load_config,
+    clear_query_cache,
+    parse_time_string,
+    format_time_string,
     construct_query_time_endpoints,
     create_influxdb_client,
+    get_influxdb_client,
     DataExtractorQueryConfig,
+    compile_id_filter,
     query_database,
+    query_database_async,
+    query_database_to_file,
+    query_database_by_day,
+    split_by_day,
     query_data_for_day,
+    query_data_for_batch,
     query_data_for_range,
 )
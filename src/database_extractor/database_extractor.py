@@ -9,14 +9,44 @@ A module for extracting data from a database and returning it as a dataframe
 Currently InfluxDB is supported, but other database types could be added
 """
 # ---------------------------------------------------------------------------
-from dataclasses import dataclass
-from datetime import datetime, timedelta
+import asyncio
+import atexit
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import csv
+from dataclasses import InitVar, dataclass
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache, partial
+import hashlib
+import io
+import json
 import logging
 from pathlib import Path
+import re
+import tempfile
+import threading
 import time
-from typing import Union
+from typing import Optional, Union
+from zoneinfo import ZoneInfo
 from collections.abc import Mapping
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+try:
+    import tomllib
+except ImportError:
+    import tomli as tomllib
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+else:
+    # Prefer the libyaml backed loader, which is much faster than the pure python one
+    YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 
 from fast_database_clients import FastInfluxDBClient
 
@@ -24,48 +54,154 @@ from fast_database_clients import FastInfluxDBClient
 logger = logging.getLogger(__name__)
 
 DEFAULT_TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+# The timezone of the prototype-zero data, matching local_tz in the influxdb config
+LOCAL_TIMEZONE = ZoneInfo("America/Vancouver")
+
+# The number of query results held in the query cache
+QUERY_CACHE_SIZE = 64
+# Results for ranges ending more recently than this may still change, so are not cached
+QUERY_CACHE_MIN_AGE = timedelta(minutes=5)
+
+_query_cache: OrderedDict = OrderedDict()
+_query_cache_lock = threading.Lock()
+
+# The Flux query, in the parts that are filled in with str.format
+# Only the range's endpoints change between queries with the same configuration
+_FLUX_QUERY = "{head}{start}, stop: {stop}{tail}"
+_FLUX_QUERY_HEAD = 'from(bucket: "{bucket}")\n    |> range(start: '
+_FLUX_STAGE_SEPARATOR = "\n    "
+_FLUX_TIME_SHIFT = "|> timeShift(duration: {tz_offset}h)"
+_FLUX_FILTER = "|> filter(fn: (r) => {filter})"
+_FLUX_PIVOT = '|> pivot(rowKey:["_time"], columnKey: ["{column_key}"], valueColumn: "_value")'
+_FLUX_GROUP = "|> group()"
+_FLUX_SORT = "|> sort(columns: {columns})"
+_FLUX_DROP = "|> drop(columns: {columns})"
+
+# Escapes for the characters that cannot appear as they are in a Flux string literal
+# Flux has no \b, \f or \u escapes, so other control characters are escaped as bytes
+_FLUX_STRING_ESCAPES = str.maketrans(
+    {
+        **{chr(c): f"\\x{c:02x}" for c in (*range(0x20), 0x7F)},
+        "\\": "\\\\",
+        '"': '\\"',
+        "\n": "\\n",
+        "\r": "\\r",
+        "\t": "\\t",
+    }
+)
+
+
+def parse_time_string(
+    time_string: str, time_format: str = DEFAULT_TIME_FORMAT
+) -> datetime:
+    """
+    Parse a time string into a datetime
+    Strings of exactly the default format's shape, YYYY-MM-DDTHH:MM:SSZ, are parsed
+    with datetime.fromisoformat as it is much faster than datetime.strptime. Anything
+    else, including ISO 8601 strings that fromisoformat would also accept, such as
+    those with a utc offset, falls back to datetime.strptime
+    :param time_string: The time string to parse
+    :param time_format: The format of the time string
+    :return: The parsed datetime
+    """
+    # The separators of YYYY-MM-DDTHH:MM:SSZ fall at every third character from the 5th
+    if (
+        time_format == DEFAULT_TIME_FORMAT
+        and len(time_string) == 20
+        and time_string[4::3] == "--T::Z"
+    ):
+        return datetime.fromisoformat(time_string[:19])
+    return datetime.strptime(time_string, time_format)
+
+
+def format_time_string(dt: datetime, time_format: str = DEFAULT_TIME_FORMAT) -> str:
+    """
+    Format a datetime as a time string
+    The default format is written with datetime.isoformat, which is faster than
+    datetime.strftime. Other formats, and timezone aware datetimes, use strftime
+    :param dt: The datetime to format
+    :param time_format: The format of the time string
+    :return: The formatted time string
+    """
+    if time_format == DEFAULT_TIME_FORMAT and dt.tzinfo is None:
+        return dt.isoformat(timespec="seconds") + "Z"
+    return dt.strftime(time_format)
 
 
 class DeltaTime(Mapping):
     """
     A class to represent a time delta
+    Instances are immutable, so the equivalent timedelta is computed once on creation
     """
 
+    __slots__ = ("days", "hours", "minutes", "seconds", "_td")
+    _fields = ("days", "hours", "minutes", "seconds")
     time_format = DEFAULT_TIME_FORMAT
 
     def __init__(
         self, days: int = 0, hours: int = 0, minutes: int = 0, seconds: int = 0
     ):
-        self.days = days
-        self.hours = hours
-        self.minutes = minutes
-        self.seconds = seconds
+        object.__setattr__(self, "days", days)
+        object.__setattr__(self, "hours", hours)
+        object.__setattr__(self, "minutes", minutes)
+        object.__setattr__(self, "seconds", seconds)
+        object.__setattr__(
+            self,
+            "_td",
+            timedelta(days=days, hours=hours, minutes=minutes, seconds=seconds),
+        )
+
+    def __setattr__(self, key, value):
+        raise AttributeError("DeltaTime is immutable")
+
+    def __delattr__(self, key):
+        raise AttributeError("DeltaTime is immutable")
+
+    def __reduce__(self):
+        return (self.__class__, (self.days, self.hours, self.minutes, self.seconds))
 
     def to_timedelta(self) -> timedelta:
-        return timedelta(
-            days=self.days, hours=self.hours, minutes=self.minutes, seconds=self.seconds
-        )
+        return self._td
 
     def __getitem__(self, key):
-        if key in self.__dict__:
-            return self.__dict__[key]
+        if key in self._fields:
+            return getattr(self, key)
         raise KeyError(f"{key} not found in DeltaTime")
 
     def __iter__(self):
-        return iter(self.__dict__)
+        return iter(self._fields)
 
     def __len__(self):
-        return len(self.__dict__)
+        return len(self._fields)
+
+    def astuple(self) -> tuple[int, int, int, int]:
+        return (self.days, self.hours, self.minutes, self.seconds)
+
+    def __eq__(self, other):
+        # Compare fields directly, rather than building a dict of each as Mapping does
+        if isinstance(other, DeltaTime):
+            return self.astuple() == other.astuple()
+        return super().__eq__(other)
+
+    def __hash__(self):
+        return hash(self.astuple())
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}(days={self.days}, hours={self.hours}, "
+            f"minutes={self.minutes}, seconds={self.seconds})"
+        )
 
     def __add__(self, other: timedelta):
         if isinstance(other, timedelta):
-            return self.to_timedelta() + other
+            return self._td + other
         elif isinstance(other, str):
-            return self.to_timedelta() + datetime.strptime(other, self.time_format)
+            # Parsed with fromisoformat for the default format, rather than strptime
+            return parse_time_string(other, self.time_format) + self._td
         elif isinstance(other, datetime):
-            return other + self.to_timedelta()
+            return other + self._td
         elif isinstance(other, DeltaTime):
-            return self.to_timedelta() + other.to_timedelta()
+            return self._td + other._td
         else:
             raise TypeError("Unsupported type for addition")
 
@@ -74,13 +210,14 @@ class DeltaTime(Mapping):
 
     def __sub__(self, other):
         if isinstance(other, timedelta):
-            return self.to_timedelta() - other
+            return self._td - other
         elif isinstance(other, str):
-            return self.to_timedelta() - datetime.strptime(other, self.time_format)
+            # A timedelta cannot have a datetime subtracted, so shift the time as for datetimes
+            return parse_time_string(other, self.time_format) - self._td
         elif isinstance(other, datetime):
-            return other - self.to_timedelta()
+            return other - self._td
         elif isinstance(other, DeltaTime):
-            return self.to_timedelta() - other.to_timedelta()
+            return self._td - other._td
         else:
             raise TypeError("Unsupported type for subtraction")
 
@@ -91,35 +228,52 @@ class DeltaTime(Mapping):
 def load_config(filepath: Union[str, Path]) -> dict:
     """
     Load a configuration file from a file path
+    Parsed files are cached, and only re-read when the file is modified
     :param filepath: The path to the configuration file
     :return: The configuration as a dictionary
     """
-    if isinstance(filepath, str):
-        filepath = Path(filepath)
+    filepath = Path(filepath)
+
+    # A single stat both checks the file exists, and fetches the cache's version info
+    try:
+        stat = filepath.stat()
+    except FileNotFoundError:
+        raise FileNotFoundError(f"File not found: {filepath}") from None
+
+    config = _load_config_cached(
+        str(filepath.resolve()), stat.st_mtime_ns, stat.st_size
+    )
+
+    # Return a copy so that callers cannot modify the cached configuration
+    return copy.deepcopy(config)
+
 
-    if not Path(filepath).exists():
-        raise FileNotFoundError(f"File not found: {filepath}")
+@lru_cache(maxsize=32)
+def _load_config_cached(filepath: str, mtime_ns: int, size: int) -> dict:
+    """
+    Parse a configuration file, cached on its resolved path, modification time and size
+    The size catches edits made within the resolution of the filesystem's timestamps
+    :param filepath: The resolved path to the configuration file
+    :param mtime_ns: The modification time of the file in ns, used to invalidate the cache
+    :param size: The size of the file in bytes, used to invalidate the cache
+    :return: The configuration as a dictionary
+    """
+    filepath = Path(filepath)
 
     # if extension is .json
     if filepath.suffix == ".json":
-        import json
-
         with open(filepath, "r") as file:
             return json.load(file)
 
     # if extension is .yaml
     if filepath.suffix == ".yaml":
-        import yaml
+        if yaml is None:
+            raise ImportError("PyYAML is required to load .yaml configuration files")
 
         with open(filepath, "r") as file:
-            return yaml.safe_load(file)
+            return yaml.load(file, Loader=YamlLoader)
     # if extension is .toml
     if filepath.suffix == ".toml":
-        try:
-            import tomllib
-        except ImportError:
-            import tomli as tomllib
-
         with open(filepath, "rb") as file:
             return tomllib.load(file)
 
@@ -145,8 +299,29 @@ class DataExtractorQueryConfig(Mapping):
     aggregate_function: str = "last"
     aggregate_window: str = "1s"
     sort_by: list[str] = None
+    downcast_floats: bool = False
+    # Ids to select, compiled into filter once here rather than on every query
+    ids: InitVar[list[str]] = None
+
+    # The Mapping interface only exposes the configuration fields, in declaration order
+    _fields = (
+        "time_format",
+        "delta_time_start",
+        "delta_time_end",
+        "tz_offset",
+        "bucket",
+        "columns_to_drop",
+        "filter",
+        "column_key",
+        "aggregate_function",
+        "aggregate_window",
+        "sort_by",
+        "downcast_floats",
+    )
 
-    def __post_init__(self):
+    def __post_init__(self, ids):
+        if ids:
+            self.filter = compile_id_filter(ids, self.column_key)
         if self.delta_time_start is None:
             self.delta_time_start = DeltaTime()
         if self.delta_time_end is None:
@@ -155,18 +330,32 @@ class DataExtractorQueryConfig(Mapping):
             self.sort_by = ["_time", "_field"]
 
     def __getitem__(self, key):
-        if key in self.__dict__:
-            return self.__dict__[key]
+        # getattr would also find methods and class attributes, which are not items
+        if key in self._fields:
+            return getattr(self, key)
         raise KeyError(f"{key} not found in DataExtractorQueryConfig")
 
     def __iter__(self):
-        return iter(self.__dict__)
+        return iter(self._fields)
 
     def __len__(self):
-        return len(self.__dict__)
+        return len(self._fields)
 
     def __repr__(self):
-        return f"DataExtractorQueryConfig({self.__dict__})"
+        return f"DataExtractorQueryConfig({dict(self)})"
+
+
+def compile_id_filter(ids: list[str], key: str = "id") -> str:
+    """
+    Construct a Flux filter selecting a list of ids with a single anchored regex
+    A single regex is compiled once per query, rather than comparing each id in turn
+    :param ids: The ids to select
+    :param key: The column holding the ids
+    :return: The Flux filter
+    """
+    # Slashes delimit Flux regex literals, so must also be escaped
+    patterns = (re.escape(id_).replace("/", "\\/") for id_ in dict.fromkeys(ids))
+    return f'r["{key}"] =~ /^({"|".join(patterns)})$/'
 
 
 def shift_string_time(
@@ -179,9 +368,8 @@ def shift_string_time(
     if isinstance(delta_time, int):
         delta_time = DeltaTime(hours=delta_time)
 
-    return (datetime.strptime(time_string, timeformat) + delta_time).strftime(
-        timeformat
-    )
+    shifted_time = parse_time_string(time_string, timeformat) + delta_time.to_timedelta()
+    return format_time_string(shifted_time, timeformat)
 
 
 def create_influxdb_client(config_path: str) -> FastInfluxDBClient:
@@ -205,6 +393,22 @@ def create_influxdb_client(config_path: str) -> FastInfluxDBClient:
         raise ConnectionError("Could not connect to InfluxDB")
 
 
+@lru_cache(maxsize=4)
+def get_influxdb_client(config_path: str) -> FastInfluxDBClient:
+    """
+    Get a shared InfluxDB client for a configuration file
+    The client is created and connected on the first call for a path, and reused by
+    later calls, so repeated extractions do not reconnect. It is closed on exit
+    :param config_path: The path to the configuration file
+    :return: The InfluxDB client
+    """
+    client = create_influxdb_client(config_path)
+    close = getattr(client, "close", None)
+    if close is not None:
+        atexit.register(close)
+    return client
+
+
 def construct_query_time_endpoints(
     query_time: Union[datetime, str],
     delta_time_start: Union[DeltaTime, tuple, list],
@@ -227,12 +431,17 @@ def construct_query_time_endpoints(
     if isinstance(delta_time_end, (tuple, list)):
         delta_time_end = DeltaTime(*delta_time_end)
     if isinstance(query_time, str):
-        query_time = datetime.strptime(query_time, time_format)
+        query_time = parse_time_string(query_time, time_format)
 
-    tz_offset = timedelta(hours=tz_offset)
+    # The query time is converted to utc once, then both deltas are added to it
+    # Plain timedelta arithmetic, avoiding the type dispatch in DeltaTime.__add__
+    if tz_offset:
+        query_time = query_time - timedelta(hours=tz_offset)
+    start_time = query_time + delta_time_start.to_timedelta()
+    end_time = query_time + delta_time_end.to_timedelta()
 
-    start_time_utc = (query_time + delta_time_start - tz_offset).strftime(time_format)
-    end_time_utc = (query_time + delta_time_end - tz_offset).strftime(time_format)
+    start_time_utc = format_time_string(start_time, time_format)
+    end_time_utc = format_time_string(end_time, time_format)
 
     return start_time_utc, end_time_utc
 
@@ -244,8 +453,88 @@ def list_to_fstring(str_list):
     :param str_list: List of strings.
     :return: Formatted string.
     """
-    formatted_elements = [f'"{s}"' for s in str_list]
-    return f'[{", ".join(formatted_elements)}]'
+    return f'[{", ".join(flux_string(s) for s in str_list)}]'
+
+
+def flux_string(value: str) -> str:
+    """
+    Quote a string as a Flux string literal
+    :param value: The string to quote
+    :return: The Flux string literal
+    """
+    # ${ would otherwise start string interpolation
+    escaped = value.translate(_FLUX_STRING_ESCAPES).replace("${", "\\${")
+    return f'"{escaped}"'
+
+
+def construct_flux_query(
+    bucket: str,
+    start_time_utc: str,
+    end_time_utc: str,
+    tz_offset: int = 0,
+    filter: str = 'r["_measurement"] =~ /.*/',
+    column_key: str = "id",
+    sort_by: list[str] = ("_time", "_field"),
+    columns_to_drop: list[str] = None,
+) -> str:
+    """
+    Construct the Flux query for a time range
+    :param bucket: The bucket to query
+    :param start_time_utc: The start of the query range in utc time format
+    :param end_time_utc: The end of the query range in utc time format
+    :param tz_offset: The timezone offset in hours, applied to the returned data
+    :param filter: A filter to be applied to the returned data
+    :param column_key: The key to use for the column axis of the pivot
+    :param sort_by: Columns to sort the result by
+    :param columns_to_drop: Columns for the server to drop from the result
+    :return: The Flux query
+    """
+    # Only the time range varies between queries with the same configuration
+    head, tail = _flux_query_template(
+        bucket,
+        tz_offset,
+        filter,
+        column_key,
+        tuple(sort_by),
+        # Duplicates are removed, keeping the order of the columns
+        tuple(dict.fromkeys(columns_to_drop or ())),
+    )
+    return _FLUX_QUERY.format(head=head, start=start_time_utc, stop=end_time_utc, tail=tail)
+
+
+@lru_cache(maxsize=32)
+def _flux_query_template(
+    bucket: str,
+    tz_offset: int,
+    filter: str,
+    column_key: str,
+    sort_by: tuple[str],
+    columns_to_drop: tuple[str],
+) -> tuple[str, str]:
+    """
+    Construct the parts of the Flux query either side of the range's endpoints
+    These are fixed for a query configuration, so are cached
+    :return: The query up to the start time, and the query following the end time
+    """
+    # This is a simple query that selects all fields from the specified bucket
+    # Returned data is timeshifted to account for the timezone offset
+    head = _FLUX_QUERY_HEAD.format(bucket=bucket)
+    stages = [")"]
+    # timeShift is a pass over every row, so it is left out when there is no offset
+    if tz_offset:
+        stages.append(_FLUX_TIME_SHIFT.format(tz_offset=tz_offset))
+    stages += [
+        _FLUX_FILTER.format(filter=filter),
+        _FLUX_PIVOT.format(column_key=column_key),
+        _FLUX_GROUP,
+        _FLUX_SORT.format(columns=list_to_fstring(sort_by)),
+        # f"|> aggregateWindow(every: {aggregate_window}, fn: {aggregate_function}, createEmpty: false)",
+    ]
+    # Dropping columns on the server means they are never sent over the wire
+    if columns_to_drop:
+        stages.append(_FLUX_DROP.format(columns=list_to_fstring(columns_to_drop)))
+    tail = _FLUX_STAGE_SEPARATOR.join(stages) + _FLUX_STAGE_SEPARATOR
+    return head, tail
 
 
 def query_database(
@@ -262,9 +551,16 @@ def query_database(
     aggregate_function="last",
     aggregate_window="1s",
     sort_by=["_time", "_field"],
+    downcast_floats=False,
+    use_cache=False,
 ):
     """
     Query a database and return the results as a dataframe
+    With use_cache, results for ranges that ended at least QUERY_CACHE_MIN_AGE ago are
+    cached, and repeated queries return a shallow copy of the cached result. The
+    returned data should therefore not be modified in place. The cache holds up to
+    QUERY_CACHE_SIZE results for the life of the process whatever their size, so it is
+    only suited to ranges that are queried repeatedly, not to bulk extraction
     :param client: The database client
     :param bucket: The bucket to query
     :param query_time: The time to query around
@@ -274,6 +570,8 @@ def query_database(
     :param filter: A filter to be applied to the returned data
     :param tz_offset: The timezone offset in hours
     :param time_format: The time format to return
+    :param downcast_floats: Whether to convert float columns to float32, halving their size
+    :param use_cache: Whether to use the query cache, off by default
     :return: The query result as a dataframe
     """
     # Construct the endpoints of the query time using the specified time deltas
@@ -286,97 +584,619 @@ def query_database(
         time_format=time_format,
     )
 
-    # Construct the Flux query. This is a simple query that selects all fields from the specified bucket
-    # Returned data is timeshifted to account for the timezone offset
-    query = f"""from(bucket: "{bucket}")
-    |> range(start: {start_time_utc}, stop: {end_time_utc})
-    |> timeShift(duration: {tz_offset}h)
-    |> filter(fn: (r) => {filter})
-    |> pivot(rowKey:["_time"], columnKey: ["{column_key}"], valueColumn: "_value")
-    |> group()
-    |> sort(columns: {list_to_fstring(sort_by)})
-    """
-    # |> aggregateWindow(every: {aggregate_window}, fn: {aggregate_function}, createEmpty: false) 
-    print(list_to_fstring(sort_by))
-    start_time_local = shift_string_time(start_time_utc, tz_offset)
-    end_time_local = shift_string_time(end_time_utc, tz_offset)
-    logger.info(
-        f"Querying {client}, bucket:{bucket}, query_time:{start_time_local} to {end_time_local}",
-        extra={
-            "bucket": bucket,
-            "start_time": start_time_utc,
-            "end_time": end_time_utc,
-            "query": query,
-        },
+    query = construct_flux_query(
+        bucket,
+        start_time_utc,
+        end_time_utc,
+        tz_offset=tz_offset,
+        filter=filter,
+        column_key=column_key,
+        sort_by=sort_by,
+        columns_to_drop=columns_to_drop,
     )
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(
+            "Querying %s, bucket:%s, query_time:%s to %s",
+            client,
+            bucket,
+            shift_string_time(start_time_utc, tz_offset),
+            shift_string_time(end_time_utc, tz_offset),
+            extra={
+                "bucket": bucket,
+                "start_time": start_time_utc,
+                "end_time": end_time_utc,
+                "query": query,
+            },
+        )
+
+    cache_key = None
+    if use_cache and parse_time_string(end_time_utc, time_format) <= (
+        datetime.now(timezone.utc).replace(tzinfo=None) - QUERY_CACHE_MIN_AGE
+    ):
+        cache_key = query_cache_key(client, query, columns_to_drop, downcast_floats)
+        result = get_cached_query(cache_key)
+        if result is not None:
+            if logger.isEnabledFor(logging.INFO):
+                logger.info(
+                    "Query returned table of size %d rows x %d columns from cache",
+                    result.shape[0],
+                    result.shape[1],
+                    extra={"result.shape": result.shape},
+                )
+            return result
 
     query_start_time = time.perf_counter()
-    result = client.query_dataframe(query)
-    if result is not None:
-        query_total_time = time.perf_counter() - query_start_time
+    result = query_dataframe(client, query, columns_to_drop, downcast_floats)
+    if logger.isEnabledFor(logging.INFO):
         logger.info(
-            f"Query returned table of size {result.shape[0]} rows x {result.shape[1]} columns in {query_total_time:.2f}s",
+            "Query returned table of size %d rows x %d columns in %.2fs",
+            result.shape[0],
+            result.shape[1],
+            time.perf_counter() - query_start_time,
             extra={"result.shape": result.shape},
         )
-        result = drop_columns(result, columns_to_drop)
-    
+
+    if cache_key is not None:
+        cache_query(cache_key, client, result)
+        return result.copy(deep=False)
     return result
 
 
+def query_cache_key(
+    client, query: str, columns_to_drop=None, downcast_floats=False
+) -> tuple[int, str]:
+    """
+    Construct the query cache key for a query
+    :param client: The database client the query is sent to
+    :param query: The Flux query
+    :param columns_to_drop: Columns dropped from the query result
+    :param downcast_floats: Whether float columns are converted to float32
+    :return: The cache key
+    """
+    key = "\0".join([query, str(downcast_floats), *sorted(columns_to_drop or ())])
+    return id(client), hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+
+def get_cached_query(cache_key) -> Optional[pd.DataFrame]:
+    """
+    Fetch a query result from the query cache
+    :param cache_key: The cache key, from query_cache_key
+    :return: A shallow copy of the cached result, or None if it is not cached
+    """
+    with _query_cache_lock:
+        entry = _query_cache.get(cache_key)
+        if entry is None:
+            return None
+        _query_cache.move_to_end(cache_key)
+    _, result = entry
+    return result.copy(deep=False)
+
+
+def cache_query(cache_key, client, result: pd.DataFrame) -> None:
+    """
+    Store a query result in the query cache, evicting the least recently used result
+    The client is held with the result, so that its id in the key cannot be reused
+    :param cache_key: The cache key, from query_cache_key
+    :param client: The database client the query was sent to
+    :param result: The query result
+    """
+    with _query_cache_lock:
+        _query_cache[cache_key] = (client, result)
+        _query_cache.move_to_end(cache_key)
+        while len(_query_cache) > QUERY_CACHE_SIZE:
+            _query_cache.popitem(last=False)
+
+
+def clear_query_cache() -> None:
+    """
+    Remove all results from the query cache
+    """
+    with _query_cache_lock:
+        _query_cache.clear()
+
+
+def query_dataframe(
+    client, query: str, columns_to_drop=None, downcast_floats=False
+) -> pd.DataFrame:
+    """
+    Run a Flux query and return the result as a dataframe
+    The response is read as Arrow and converted to pandas column by column. Clients
+    without raw query support, or responses Arrow cannot read, fall back to the
+    client's query_dataframe. A response Arrow cannot read is queried a second time
+    :param client: The database client
+    :param query: The Flux query
+    :param columns_to_drop: Columns to drop from the resulting dataframe
+    :param downcast_floats: Whether to convert float columns to float32
+    :return: The query result as a dataframe
+    """
+    if hasattr(client, "_client"):
+        try:
+            table = query_arrow(client, query, columns_to_drop, downcast_floats)
+        except pa.ArrowInvalid as error:
+            # The fallback runs the whole query again on the server
+            logger.warning(
+                "Could not read query response as Arrow, re-running the query with "
+                "query_dataframe: %s\nQuery: %s",
+                error,
+                query,
+                extra={"query": query},
+            )
+        else:
+            if table is None:
+                return pd.DataFrame()
+            # Arrow buffers are released as each column is converted, limiting peak memory
+            return table.to_pandas(split_blocks=True, self_destruct=True)
+
+    result = client.query_dataframe(query)
+    if result is None:
+        return pd.DataFrame()
+    result = drop_columns(result, columns_to_drop or [])
+    if downcast_floats:
+        float_columns = result.select_dtypes("float64").columns
+        result[float_columns] = result[float_columns].astype("float32")
+    return result
+
+
+def query_arrow(
+    client, query: str, columns_to_drop=None, downcast_floats=False
+) -> Optional[pa.Table]:
+    """
+    Run a Flux query and return the result as an Arrow table
+    Dropped columns are removed from the table's schema, so they are never converted
+    :param client: The database client
+    :param query: The Flux query
+    :param columns_to_drop: Columns to drop from the resulting table
+    :param downcast_floats: Whether to convert float columns to float32
+    :return: The query result as an Arrow table, or None if there is no data
+    """
+    response = client._client.query_api().query_raw(query)
+    try:
+        reader = read_flux_csv(response)
+        if reader is None:
+            return None
+        table = reader.read_all()
+    finally:
+        response.close()
+
+    schema = project_schema(table.schema, columns_to_drop, downcast_floats)
+    table = table.select(schema.names)
+    if downcast_floats:
+        table = table.cast(schema)
+    return table
+
+
+def project_schema(
+    schema: pa.Schema, columns_to_drop=None, downcast_floats=False
+) -> pa.Schema:
+    """
+    Construct the schema of a query result once columns are dropped and converted
+    Both are applied to the Arrow data in a single pass, before conversion to pandas
+    :param schema: The schema of the query result
+    :param columns_to_drop: The columns to drop
+    :param downcast_floats: Whether to convert float columns to float32
+    :return: The projected schema
+    """
+    columns = columns_to_keep(schema.names, columns_to_drop)
+    schema_fields = [schema.field(name) for name in columns]
+    if downcast_floats:
+        schema_fields = [
+            field.with_type(pa.float32()) if field.type == pa.float64() else field
+            for field in schema_fields
+        ]
+    return pa.schema(schema_fields)
+
+
+def columns_to_keep(columns: list[str], columns_to_drop=None) -> list[str]:
+    """
+    Filter the dropped columns from a list of columns
+    The unnamed annotation column of a Flux csv response is always dropped
+    :param columns: The columns to filter
+    :param columns_to_drop: The columns to drop
+    :return: The remaining columns, in order
+    """
+    columns_to_drop = set(columns_to_drop or ()) | {""}
+    return [column for column in columns if column not in columns_to_drop]
+
+
+async def query_database_async(client, query_time, executor=None, **query_kwargs):
+    """
+    Query a database without blocking the event loop
+    The query is run by query_database in an executor, so that several queries can be
+    awaited concurrently, for example with asyncio.gather
+    :param client: The database client
+    :param query_time: The time to query around
+    :param executor: The executor to run the query in, or None for the loop's default
+    :param query_kwargs: Further arguments passed to query_database
+    :return: The query result as a dataframe
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor,
+        partial(query_database, client=client, query_time=query_time, **query_kwargs),
+    )
+
+
+def query_database_to_file(
+    client,
+    filepath,
+    bucket,
+    query_time,
+    delta_time_start,
+    delta_time_end,
+    columns_to_drop=None,
+    filter='r["_measurement"] =~ /.*/',
+    column_key="id",
+    tz_offset=0,
+    time_format=DEFAULT_TIME_FORMAT,
+    aggregate_function="last",
+    aggregate_window="1s",
+    sort_by=["_time", "_field"],
+    downcast_floats=False,
+    compression="lz4",
+) -> int:
+    """
+    Query a database and stream the results to a parquet file
+    The response is written batch by batch as it is received, without building a
+    dataframe, so memory use is bounded by the batch size rather than the result size
+    If the response cannot be read part way through, the partial file is removed
+    :param client: The database client
+    :param filepath: The path of the parquet file to write
+    :param bucket: The bucket to query
+    :param query_time: The time to query around
+    :param delta_time_start: The time delta to subtract from the query time
+    :param delta_time_end: The time delta to add to the query time
+    :param columns_to_drop: Columns to drop from the written data
+    :param filter: A filter to be applied to the returned data
+    :param tz_offset: The timezone offset in hours
+    :param time_format: The time format to return
+    :param downcast_floats: Whether to convert float columns to float32
+    :param compression: The parquet compression codec
+    :return: The number of rows written
+    """
+    start_time_utc, end_time_utc = construct_query_time_endpoints(
+        query_time,
+        delta_time_start,
+        delta_time_end,
+        tz_offset=tz_offset,
+        time_format=time_format,
+    )
+    query = construct_flux_query(
+        bucket,
+        start_time_utc,
+        end_time_utc,
+        tz_offset=tz_offset,
+        filter=filter,
+        column_key=column_key,
+        sort_by=sort_by,
+        columns_to_drop=columns_to_drop,
+    )
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(
+            "Querying %s, bucket:%s, writing to %s",
+            client,
+            bucket,
+            filepath,
+            extra={
+                "bucket": bucket,
+                "start_time": start_time_utc,
+                "end_time": end_time_utc,
+                "query": query,
+            },
+        )
+
+    query_start_time = time.perf_counter()
+    response = client._client.query_api().query_raw(query)
+    try:
+        reader = read_flux_csv(response)
+    except Exception:
+        response.close()
+        raise
+    if reader is None:
+        response.close()
+        logger.info("Query returned no data", extra={"filepath": filepath})
+        return 0
+
+    schema = project_schema(reader.schema, columns_to_drop, downcast_floats)
+
+    rows = 0
+    try:
+        with pq.ParquetWriter(filepath, schema, compression=compression) as writer:
+            for batch in reader:
+                table = pa.Table.from_batches([batch.select(schema.names)])
+                if downcast_floats:
+                    table = table.cast(schema)
+                writer.write_table(table)
+                rows += table.num_rows
+    except Exception:
+        # A partially written file would otherwise pass for a complete result
+        Path(filepath).unlink(missing_ok=True)
+        raise
+    finally:
+        response.close()
+
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(
+            "Query wrote %d rows x %d columns to %s in %.2fs",
+            rows,
+            len(schema),
+            filepath,
+            time.perf_counter() - query_start_time,
+            extra={"filepath": filepath, "rows": rows},
+        )
+    return rows
+
+
+# Arrow types of the datatypes used in Flux annotated csv
+FLUX_ARROW_TYPES = {
+    "string": pa.string(),
+    "long": pa.int64(),
+    "unsignedLong": pa.uint64(),
+    "double": pa.float64(),
+    "boolean": pa.bool_(),
+    "dateTime:RFC3339": pa.timestamp("ns", tz="UTC"),
+    "dateTime:RFC3339Nano": pa.timestamp("ns", tz="UTC"),
+}
+
+
+def read_flux_csv(stream) -> Optional[pa_csv.CSVStreamingReader]:
+    """
+    Open a streaming Arrow reader over a Flux annotated csv response
+    Column types are taken from the #datatype annotation, so they do not have to be
+    inferred from the first block of data. The result must be a single table
+    :param stream: A binary file-like object containing the annotated csv
+    :return: A reader yielding record batches, or None if the response is empty
+    :raises RuntimeError: If the response is an error reported by the server
+    """
+    stream = io.BufferedReader(stream) if not hasattr(stream, "peek") else stream
+
+    datatypes = None
+    for line in stream:
+        line = line.decode().rstrip("\r\n")
+        if not line:
+            continue
+        if line.startswith("#datatype"):
+            datatypes = next(csv.reader([line]))
+        elif not line.startswith("#"):
+            # The first line which is not an annotation is the header
+            names = next(csv.reader([line]))
+            break
+    else:
+        return None
+
+    # Errors after the response has started are sent as a table of their own
+    if names == ["", "error", "reference"]:
+        row = next(csv.reader(line.decode() for line in stream), None)
+        message, reference = row[1:3] if row and len(row) >= 3 else ("", "")
+        raise RuntimeError(f"Flux query failed: {message} (reference: {reference})")
+
+    column_types = {}
+    if datatypes is not None:
+        for name, datatype in zip(names, datatypes):
+            column_types[name] = FLUX_ARROW_TYPES.get(datatype, pa.string())
+
+    return pa_csv.open_csv(
+        stream,
+        read_options=pa_csv.ReadOptions(column_names=names),
+        convert_options=pa_csv.ConvertOptions(column_types=column_types),
+    )
+
+
+def query_database_by_day(
+    client,
+    query_time,
+    days,
+    delta_time_start=(0, 0, 0, 0),
+    delta_time_end=(1, 0, 0, 0),
+    time_format=DEFAULT_TIME_FORMAT,
+    time_column="_time",
+    **query_kwargs,
+) -> dict[datetime, pd.DataFrame]:
+    """
+    Query a number of consecutive days with a single query, and split the result by day
+    The query is one continuous range, from the first day plus delta_time_start to the
+    last day plus delta_time_end, so the deltas must span exactly one day. A shorter
+    window would otherwise include the gaps between days.
+    Issuing one query for the whole range saves a round-trip and query plan per day
+    :param client: The database client
+    :param query_time: The time of the first day to query around
+    :param days: The number of days to query
+    :param delta_time_start: The time delta to subtract from each day's query time
+    :param delta_time_end: The time delta to add to each day's query time
+    :param time_format: The time format of query_time
+    :param time_column: The column containing the (timezone shifted) time of each row
+    :param query_kwargs: Further arguments passed to query_database
+    :return: A dictionary of dataframes, keyed by the date of the rows they contain
+    :raises ValueError: If the time deltas do not span exactly one day
+    """
+    if isinstance(delta_time_start, (tuple, list)):
+        delta_time_start = DeltaTime(*delta_time_start)
+    if isinstance(delta_time_end, (tuple, list)):
+        delta_time_end = DeltaTime(*delta_time_end)
+    if delta_time_end.to_timedelta() - delta_time_start.to_timedelta() != timedelta(days=1):
+        raise ValueError(
+            "delta_time_start and delta_time_end must span exactly one day, "
+            f"got {delta_time_start} to {delta_time_end}"
+        )
+
+    # Stretch the end of the query to cover the last day in the range
+    range_delta_end = timedelta(days=days - 1) + delta_time_end.to_timedelta()
+    range_delta_end = DeltaTime(
+        days=range_delta_end.days, seconds=range_delta_end.seconds
+    )
+
+    result = query_database(
+        client=client,
+        query_time=query_time,
+        delta_time_start=delta_time_start,
+        delta_time_end=range_delta_end,
+        time_format=time_format,
+        **query_kwargs,
+    )
+    if result is None or result.empty:
+        return {}
+
+    return split_by_day(result, time_column)
+
+
+def split_by_day(df: pd.DataFrame, time_column="_time") -> dict[datetime, pd.DataFrame]:
+    """
+    Split a dataframe into one dataframe per calendar day of its time column
+    :param df: The dataframe to split
+    :param time_column: The column containing the time of each row
+    :return: A dictionary of dataframes, keyed by date
+    """
+    days = df[time_column].dt.floor("D")
+    return {
+        day.to_pydatetime().replace(tzinfo=None): group.reset_index(drop=True)
+        for day, group in df.groupby(days, sort=True)
+    }
+
+
 def drop_columns(df: pd.DataFrame, columns_to_drop: list[str]) -> pd.DataFrame:
-    columns_exist = []
-    for column in columns_to_drop:
-        if column in df.columns:
-            columns_exist.append(column)
-    df.drop(columns = columns_exist, inplace = True)
+    # Columns that are not in the dataframe are ignored
+    df.drop(columns=df.columns.intersection(columns_to_drop), inplace=True)
     return df
 
 
-def process_results(df: pd.DataFrame, current_date: datetime) -> None:
+def aggregate_results(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Index query results on time, keeping the last value of each column in each second
+    :param df: The query results
+    :return: The aggregated results
+    """
+    df = df.set_index("_time")
+    # Grouping on the floored time only creates the seconds that have data, unlike
+    # resample, so there are no empty rows to drop afterwards
+    return df.groupby(df.index.floor("1s")).last()
+
+
+def results_filepath(current_date: datetime, file_format: str) -> str:
+    """
+    The path of the file a day of results is written to
+    :param current_date: The day of the results
+    :param file_format: The format of the file
+    :return: The path of the file
+    """
+    return f"/srv/data/influx/prototype-zero_realtime-data_{current_date.year}-{current_date.month:02d}-{current_date.day:02d}.{file_format}"
+    # return f"/nfs/research/gfyvrdatadash/influx/prototype-zero_realtime-data_{current_date.year}-{current_date.month:02d}-{current_date.day:02d}.{file_format}"
+
+
+def enough_results(rows: int, current_date: datetime) -> bool:
+    """
+    Check whether a day has enough rows of results to be written, logging if not
+    :param rows: The number of rows of results
+    :param current_date: The day of the results
+    :return: Whether the results should be written
+    """
     # df is empty
-    if df.size == 0:
+    if rows == 0:
         logger.info(f"No data for {current_date.year}-{current_date.month:02d}-{current_date.day:02d}.")
-        return
+        return False
     # df has less than 10 rows
-    if df.shape[0] < 10:
+    if rows < 10:
         logger.info(f"Less than 10 rows for {current_date.year}-{current_date.month:02d}-{current_date.day:02d}; Ignoring results.")
+        return False
+    return True
+
+
+def process_results(
+    df: pd.DataFrame, current_date: datetime, file_format: str = "csv"
+) -> None:
+    """
+    Resample a day of query results and write them to a file
+    :param df: The query results for the day
+    :param current_date: The day of the results
+    :param file_format: The format of the file, either "csv" or "parquet". Parquet is
+        written by Arrow's columnar writer, which is much faster than csv and smaller
+    """
+    if file_format not in ("csv", "parquet"):
+        raise ValueError(f"Unsupported file format: {file_format}")
+    if not enough_results(df.shape[0] if df.size else 0, current_date):
         return
 
     # Do something with the result
-    df = df.set_index("_time")
-    df = df.resample(rule = "1s").last()
-    df = df.dropna(axis = 0, how = "all")
+    df = aggregate_results(df)
+    filepath = results_filepath(current_date, file_format)
     try:
-        df.to_csv(f"/srv/data/influx/prototype-zero_realtime-data_{current_date.year}-{current_date.month:02d}-{current_date.day:02d}.csv")
-        # df.to_csv(f"/nfs/research/gfyvrdatadash/influx/prototype-zero_realtime-data_{current_date.year}-{current_date.month:02d}-{current_date.day:02d}.csv")
+        if file_format == "parquet":
+            df.to_parquet(filepath, engine="pyarrow", compression="zstd", index=True)
+        else:
+            df.to_csv(filepath)
     except Exception as error:
         logger.error(f"{error}")
     else:
-        logger.info(f"csv created for {current_date.year}-{current_date.month:02d}-{current_date.day:02d}.")
+        logger.info(f"{file_format} created for {current_date.year}-{current_date.month:02d}-{current_date.day:02d}.")
 
 
-def timezone_offset(current_date: datetime) -> int:
-    # NOTE: This currently is only set up for 2024
-    DST_start = datetime(2024, 3, 10, 2)
-    DST_end = datetime(2024, 11, 3, 1)
-    
-    if (current_date - DST_start).total_seconds() > 0 and (DST_end - current_date).total_seconds() > 0:
-        return -7
+def write_windows(
+    window_paths: list[Path], rows: int, current_date: datetime, file_format: str = "csv"
+) -> None:
+    """
+    Write a day of aggregated results, spilled to parquet files window by window, to a
+    single file. The columns of the windows can differ, so they are unified first. The
+    windows are read back one at a time, so only one is held in memory
+    :param window_paths: The parquet files of the aggregated windows, in time order
+    :param rows: The total number of rows in the windows
+    :param current_date: The day of the results
+    :param file_format: The format of the file, either "csv" or "parquet"
+    """
+    if file_format not in ("csv", "parquet"):
+        raise ValueError(f"Unsupported file format: {file_format}")
+    if not enough_results(rows, current_date):
+        return
+
+    # Columns missing from a window are filled with nulls, with types promoted as needed
+    schema = pa.unify_schemas(
+        [pq.read_schema(path) for path in window_paths], promote_options="permissive"
+    )
+    filepath = results_filepath(current_date, file_format)
+    try:
+        if file_format == "parquet":
+            with pq.ParquetWriter(filepath, schema, compression="zstd") as writer:
+                for path in window_paths:
+                    table = pq.read_table(path)
+                    for field in schema:
+                        if field.name not in table.column_names:
+                            table = table.append_column(
+                                field, pa.nulls(table.num_rows, field.type)
+                            )
+                    writer.write_table(table.select(schema.names).cast(schema))
+        else:
+            columns = [name for name in schema.names if name != "_time"]
+            for index, path in enumerate(window_paths):
+                window = pd.read_parquet(path).reindex(columns=columns)
+                window.to_csv(filepath, mode="a" if index else "w", header=not index)
+    except Exception as error:
+        # A partially written file would otherwise pass for a complete day
+        Path(filepath).unlink(missing_ok=True)
+        logger.error(f"{error}")
     else:
-        return -8
+        logger.info(f"{file_format} created for {current_date.year}-{current_date.month:02d}-{current_date.day:02d}.")
+
+
+def timezone_offset(current_date: datetime) -> int:
+    """
+    The utc offset of the local timezone at a local time, including daylight saving
+    :param current_date: The local time
+    :return: The timezone offset in hours
+    """
+    return current_date.replace(tzinfo=LOCAL_TIMEZONE).utcoffset() // timedelta(hours=1)
     
 
-def query_data_for_day(client: FastInfluxDBClient, current_date: datetime) -> None:
+def daily_query_config(tz_offset: int) -> dict:
+    """
+    The query configuration for extracting a day of prototype-zero data
+    :param tz_offset: The timezone offset in hours
+    :return: The query configuration, as arguments for query_database
+    """
     time_fmt = "%Y-%m-%dT%H:%M:%SZ"
-    query_time = current_date.strftime(time_fmt)
-    tz_offset = timezone_offset(current_date)
 
     drop_list = ["result", "table", "_start",
                  "_stop", "_measurement", "datatype",
                  "_field", "_measurement", "category",
                  "level", "machine", "module", "display_name"]
 
-    query_config = dict(
+    return dict(
         bucket = 'prototype-zero',
         time_format = time_fmt,
         delta_time_start = [0, 0, 0, 0],
@@ -389,32 +1209,157 @@ def query_data_for_day(client: FastInfluxDBClient, current_date: datetime) -> No
         column_key = 'id',
     )
 
-    # Query the database, and return a Pandas DataFrame object
-    result = query_database(
+
+def query_data_for_day(
+    client: FastInfluxDBClient,
+    current_date: datetime,
+    file_format: str = "csv",
+    chunk_hours: Optional[int] = None,
+) -> None:
+    """
+    Query and process the data for a day
+    :param client: The database client
+    :param current_date: The day to query
+    :param file_format: The format of the file written, see process_results
+    :param chunk_hours: If set, query the day in windows of this many hours. Each
+        window is aggregated and spilled to a temporary file as it arrives, then the
+        windows are written to the day's file one at a time. Only one window is held in
+        memory at a time rather than the whole day, at the cost of writing it twice
+    """
+    query_config = daily_query_config(timezone_offset(current_date))
+    query_time = format_time_string(current_date, query_config["time_format"])
+
+    if not chunk_hours:
+        # Query the database, and return a Pandas DataFrame object
+        result = query_database(
+            client=client,
+            query_time=query_time,
+            **query_config,
+        )
+        process_results(result, current_date, file_format)
+        return
+
+    # The columns returned by the pivot can differ between windows, so they cannot be
+    # appended to the day's file as they arrive. Each is spilled to disk instead, and
+    # the columns are unified once all of the windows are known
+    with tempfile.TemporaryDirectory() as spill_directory:
+        window_paths = []
+        rows = 0
+        for start_hour in range(0, 24, chunk_hours):
+            query_config["delta_time_start"] = [0, start_hour, 0, 0]
+            query_config["delta_time_end"] = [0, min(start_hour + chunk_hours, 24), 0, 0]
+            chunk = query_database(
+                client=client,
+                query_time=query_time,
+                **query_config,
+            )
+            if chunk.empty:
+                continue
+            window = aggregate_results(chunk)
+            del chunk
+            window_path = Path(spill_directory) / f"{start_hour:02d}.parquet"
+            window.to_parquet(window_path, engine="pyarrow", index=True)
+            window_paths.append(window_path)
+            rows += len(window)
+            del window
+
+        write_windows(window_paths, rows, current_date, file_format)
+
+
+def query_data_for_batch(
+    client: FastInfluxDBClient,
+    start_date: datetime,
+    days: int,
+    file_format: str = "csv",
+    chunk_hours: Optional[int] = None,
+) -> None:
+    """
+    Query and process the data for a number of consecutive days with a single query
+    The days must share the same timezone offset. The raw result of the whole batch is
+    held in memory, alongside its per-day copies while it is split, so peak memory is
+    about twice the batch's raw data
+    :param client: The database client
+    :param start_date: The first day to query
+    :param days: The number of days to query
+    :param file_format: The format of the file written for each day, see process_results
+    :param chunk_hours: If set, each day is instead queried on its own in windows of
+        this many hours, see query_data_for_day
+    """
+    dates = pd.date_range(start_date, periods=days, freq="D").to_pydatetime()
+    if chunk_hours:
+        for date in dates:
+            query_data_for_day(client, date, file_format, chunk_hours)
+        return
+
+    query_config = daily_query_config(timezone_offset(start_date))
+    query_time = format_time_string(start_date, query_config["time_format"])
+
+    # Query the whole batch at once, and split the result into days
+    results = query_database_by_day(
         client=client,
         query_time=query_time,
+        days=days,
         **query_config,
     )
 
-    process_results(result, current_date)
+    # Each day is released once it has been written
+    for date in dates:
+        process_results(results.pop(date, pd.DataFrame()), date, file_format)
 
 
-def query_data_for_range(client: FastInfluxDBClient, start_date: datetime, end_date: datetime) -> None:
-    # NOTE: Watch for leap year
-    days_in_each_month = [31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
-    up_to_date = False
-    for (month, days) in enumerate(days_in_each_month):
-        if start_date.month > month:
-            continue
-        if not up_to_date:
-            for j in range(days):
-                if start_date.day > days:
-                    continue
-                if (end_date.month == month+1) and (end_date.day == j+1):
-                    logger.info("Reached end date.")
-                    up_to_date = True
-                    break
-                date = datetime(2024,month+1,j+1)
-                query_data_for_day(client, date)
-        else:
-            break
+def query_data_for_range(
+    client: FastInfluxDBClient,
+    start_date: datetime,
+    end_date: datetime,
+    batch_days: int = 7,
+    max_workers: int = 2,
+    file_format: str = "csv",
+    chunk_hours: Optional[int] = None,
+) -> None:
+    """
+    Query and process the data for each day from start_date, up to but excluding end_date
+    Consecutive days are queried in batches of up to batch_days with a single query,
+    split where the timezone offset changes. The same client is reused for every batch
+    The batches are queried concurrently in a thread pool, as the work is mostly waiting
+    on the database and the disk. Each day is written to its own file
+    Peak memory is about 2 x max_workers x batch_days days of raw results, as each
+    batch is held alongside its per-day copies while it is split. The defaults hold
+    about four weeks of data; lower either for wide data, or set chunk_hours
+    :param client: The database client
+    :param start_date: The first day to query
+    :param end_date: The day to stop at, which is not queried
+    :param batch_days: The largest number of days to query at once
+    :param max_workers: The number of batches to query at once, which should not
+        exceed the connection pool size of the client. Each worker holds a batch
+    :param file_format: The format of the file written for each day, see process_results
+    :param chunk_hours: If set, each day is queried in windows of this many hours
+        rather than in batches, holding one window per worker, see query_data_for_day
+    """
+    days = pd.date_range(start_date, end_date, freq="D", normalize=True, inclusive="left")
+
+    batches = []
+    batch_offset = None
+    for date in days.to_pydatetime():
+        # The offset is looked up once per day, and held for the current batch
+        offset = timezone_offset(date)
+        if not batches or len(batches[-1]) == batch_days or offset != batch_offset:
+            batches.append([])
+            batch_offset = offset
+        batches[-1].append(date)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                query_data_for_batch,
+                client,
+                batch[0],
+                len(batch),
+                file_format,
+                chunk_hours,
+            )
+            for batch in batches
+        ]
+        # Raise the first error, if any, once all of the batches have finished
+        for future in futures:
+            future.result()
+    logger.info("Reached end date.")
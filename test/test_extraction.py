@@ -0,0 +1,108 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from database_extractor import split_by_day
+import database_extractor.database_extractor as extractor
+
+
+def test_split_by_day():
+    times = pd.date_range("2024-05-16T12:00:00Z", periods=48, freq="h")
+    df = pd.DataFrame({"_time": times, "value": range(48)})
+
+    days = split_by_day(df)
+
+    assert list(days) == [
+        datetime(2024, 5, 16),
+        datetime(2024, 5, 17),
+        datetime(2024, 5, 18),
+    ]
+    assert [len(day) for day in days.values()] == [12, 24, 12]
+    assert days[datetime(2024, 5, 17)].index[0] == 0
+
+
+def test_query_data_for_range_batches(monkeypatch):
+    batches = []
+    monkeypatch.setattr(
+        extractor,
+        "query_data_for_batch",
+        lambda client, start_date, days, file_format, chunk_hours: batches.append(
+            (start_date, days, chunk_hours)
+        ),
+    )
+
+    extractor.query_data_for_range(
+        None,
+        datetime(2024, 3, 1),
+        datetime(2024, 3, 20),
+        batch_days=7,
+        max_workers=4,
+        chunk_hours=6,
+    )
+
+    assert sorted(batches) == [
+        (datetime(2024, 3, 1), 7, 6),
+        (datetime(2024, 3, 8), 3, 6),
+        (datetime(2024, 3, 11), 7, 6),
+        (datetime(2024, 3, 18), 2, 6),
+    ]
+
+
+def test_query_data_for_batch_in_chunks(monkeypatch):
+    days = []
+    monkeypatch.setattr(
+        extractor,
+        "query_data_for_day",
+        lambda client, current_date, file_format, chunk_hours: days.append(
+            (current_date, chunk_hours)
+        ),
+    )
+
+    extractor.query_data_for_batch(None, datetime(2024, 5, 16), 2, chunk_hours=6)
+
+    assert days == [(datetime(2024, 5, 16), 6), (datetime(2024, 5, 17), 6)]
+
+
+@pytest.mark.parametrize("file_format", ["csv", "parquet"])
+def test_query_data_for_day_in_chunks(monkeypatch, tmp_path, file_format):
+    windows = []
+
+    def query_database(**query_kwargs):
+        start_hour = query_kwargs["delta_time_start"][1]
+        windows.append((start_hour, query_kwargs["delta_time_end"][1]))
+        times = pd.date_range(f"2024-05-16T{start_hour:02d}:00:00", periods=12, freq="500ms")
+        return pd.DataFrame({"_time": times, f"sensor_{start_hour}": range(12)})
+
+    filepath = tmp_path / f"result.{file_format}"
+    monkeypatch.setattr(extractor, "query_database", query_database)
+    monkeypatch.setattr(
+        extractor, "results_filepath", lambda current_date, file_format: filepath
+    )
+
+    extractor.query_data_for_day(
+        None, datetime(2024, 5, 16), file_format=file_format, chunk_hours=10
+    )
+
+    assert windows == [(0, 10), (10, 20), (20, 24)]
+    if file_format == "csv":
+        result = pd.read_csv(filepath, index_col="_time", parse_dates=["_time"])
+    else:
+        result = pd.read_parquet(filepath)
+    # Each window has its own column, which is empty in the other windows
+    assert list(result.columns) == ["sensor_0", "sensor_10", "sensor_20"]
+    assert result.shape == (18, 3)
+    assert result.index.is_monotonic_increasing
+    assert result["sensor_10"].notna().sum() == 6
+    assert result.loc["2024-05-16T10:00:01", "sensor_10"] == 3
+
+
+def test_query_database_by_day_rejects_partial_day_window():
+    with pytest.raises(ValueError):
+        extractor.query_database_by_day(
+            client=None,
+            query_time="2024-05-16T00:00:00Z",
+            days=2,
+            delta_time_start=(0, 8, 0, 0),
+            delta_time_end=(0, 17, 0, 0),
+        )
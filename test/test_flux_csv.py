@@ -0,0 +1,260 @@
+import io
+import logging
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from database_extractor import clear_query_cache, query_database, query_database_to_file
+from database_extractor.database_extractor import read_flux_csv
+
+ANNOTATED_CSV = (
+    b"#datatype,string,long,dateTime:RFC3339,double,string\r\n"
+    b"#group,false,false,false,false,true\r\n"
+    b"#default,_result,,,,\r\n"
+    b",result,table,_time,temperature,_measurement\r\n"
+    b",,0,2024-05-16T08:00:01Z,,heater\r\n"
+    b",,0,2024-05-16T08:00:02Z,21.5,heater\r\n"
+    b"\r\n"
+)
+
+
+def test_read_flux_csv_uses_annotated_types():
+    reader = read_flux_csv(io.BytesIO(ANNOTATED_CSV))
+
+    table = reader.read_all()
+
+    assert table.num_rows == 2
+    assert str(table.schema.field("table").type) == "int64"
+    assert str(table.schema.field("_time").type) == "timestamp[ns, tz=UTC]"
+    # The first value is empty, so would be inferred as null without the annotation
+    assert str(table.schema.field("temperature").type) == "double"
+    assert table.column("temperature").to_pylist() == [None, 21.5]
+
+
+def test_read_flux_csv_empty_response():
+    assert read_flux_csv(io.BytesIO(b"\r\n")) is None
+
+
+class FakeQueryApi:
+    def __init__(self, client):
+        self.client = client
+
+    def query_raw(self, query):
+        self.client.queries.append(query)
+        return io.BytesIO(self.client.body)
+
+
+class FakeInfluxDBClient:
+    def __init__(self, client):
+        self.query_api = lambda: FakeQueryApi(client)
+
+
+class FakeClient:
+    def __init__(self, body):
+        self.body = body
+        self.queries = []
+        self._client = FakeInfluxDBClient(self)
+
+
+def test_query_database_drops_columns():
+    result = query_database(
+        client=FakeClient(ANNOTATED_CSV),
+        bucket="test",
+        query_time="2024-05-16T10:00:00Z",
+        delta_time_start=(0, -2, 0, 0),
+        delta_time_end=(0, 1, 0, 0),
+        columns_to_drop=["result", "table", "_measurement"],
+    )
+
+    assert list(result.columns) == ["_time", "temperature"]
+    assert len(result) == 2
+
+
+def test_query_database_no_data():
+    result = query_database(
+        client=FakeClient(b"\r\n"),
+        bucket="test",
+        query_time="2024-05-16T10:00:00Z",
+        delta_time_start=(0, -2, 0, 0),
+        delta_time_end=(0, 1, 0, 0),
+    )
+
+    assert result.empty
+
+
+def test_query_database_cache():
+    clear_query_cache()
+    client = FakeClient(ANNOTATED_CSV)
+    query_config = dict(
+        bucket="test",
+        query_time="2024-05-16T10:00:00Z",
+        delta_time_start=(0, -2, 0, 0),
+        delta_time_end=(0, 1, 0, 0),
+    )
+
+    first = query_database(client=client, use_cache=True, **query_config)
+    second = query_database(client=client, use_cache=True, **query_config)
+    query_database(client=client, **query_config)
+
+    assert len(client.queries) == 2
+    assert second.equals(first)
+    assert second is not first
+
+
+def test_query_database_downcast_floats():
+    result = query_database(
+        client=FakeClient(ANNOTATED_CSV),
+        bucket="test",
+        query_time="2024-05-16T10:00:00Z",
+        delta_time_start=(0, -2, 0, 0),
+        delta_time_end=(0, 1, 0, 0),
+        columns_to_drop=["result", "table"],
+        downcast_floats=True,
+    )
+
+    assert str(result["temperature"].dtype) == "float32"
+    assert str(result["_measurement"].dtype) == "object"
+
+
+class FakeDataFrameClient:
+    def __init__(self, result):
+        self.result = result
+        self.queries = []
+
+    def query_dataframe(self, query):
+        self.queries.append(query)
+        return None if self.result is None else self.result.copy()
+
+
+def test_query_database_falls_back_to_query_dataframe():
+    client = FakeDataFrameClient(
+        pd.DataFrame({"result": ["_result"], "_time": [0], "temperature": [21.5]})
+    )
+    result = query_database(
+        client=client,
+        bucket="test",
+        query_time="2024-05-16T10:00:00Z",
+        delta_time_start=(0, -2, 0, 0),
+        delta_time_end=(0, 1, 0, 0),
+        columns_to_drop=["result"],
+        downcast_floats=True,
+        use_cache=False,
+    )
+
+    assert len(client.queries) == 1
+    assert list(result.columns) == ["_time", "temperature"]
+    assert str(result["temperature"].dtype) == "float32"
+
+
+class FakeFallbackClient(FakeClient):
+    def __init__(self, body, result):
+        super().__init__(body)
+        self.result = result
+
+    def query_dataframe(self, query):
+        self.queries.append(query)
+        return self.result
+
+
+def test_query_database_falls_back_when_arrow_cannot_read(caplog):
+    # The second data row has more fields than the header, which Arrow rejects
+    body = ANNOTATED_CSV.replace(b"21.5,heater", b"21.5,heater,extra")
+    client = FakeFallbackClient(body, pd.DataFrame({"temperature": [21.5]}))
+
+    with caplog.at_level(logging.WARNING):
+        result = query_database(
+            client=client,
+            bucket="test",
+            query_time="2024-05-16T10:00:00Z",
+            delta_time_start=(0, -2, 0, 0),
+            delta_time_end=(0, 1, 0, 0),
+        )
+
+    assert len(client.queries) == 2
+    assert list(result.columns) == ["temperature"]
+    assert "re-running the query" in caplog.text
+    assert client.queries[0] in caplog.text
+
+
+def test_query_database_fallback_returns_no_data():
+    result = query_database(
+        client=FakeDataFrameClient(None),
+        bucket="test",
+        query_time="2024-05-16T10:00:00Z",
+        delta_time_start=(0, -2, 0, 0),
+        delta_time_end=(0, 1, 0, 0),
+    )
+
+    assert result.empty
+
+
+def test_query_database_to_file(tmp_path):
+    filepath = tmp_path / "result.parquet"
+
+    rows = query_database_to_file(
+        client=FakeClient(ANNOTATED_CSV),
+        filepath=filepath,
+        bucket="test",
+        query_time="2024-05-16T10:00:00Z",
+        delta_time_start=(0, -2, 0, 0),
+        delta_time_end=(0, 1, 0, 0),
+        columns_to_drop=["result", "table"],
+        downcast_floats=True,
+    )
+
+    assert rows == 2
+    assert pq.read_metadata(filepath).num_rows == 2
+    schema = pq.read_schema(filepath)
+    assert schema.names == ["_time", "temperature", "_measurement"]
+    assert str(schema.field("temperature").type) == "float"
+
+
+def test_query_database_to_file_removes_partial_file(tmp_path):
+    filepath = tmp_path / "result.parquet"
+    # Enough rows to fill the first read block, followed by a row Arrow cannot read
+    rows = b",,0,2024-05-16T08:00:02Z,21.5,heater\r\n" * 50_000
+    body = ANNOTATED_CSV.rstrip(b"\r\n") + b"\r\n" + rows + b",,0,extra,,,,\r\n"
+
+    with pytest.raises(pa.ArrowInvalid):
+        query_database_to_file(
+            client=FakeClient(body),
+            filepath=filepath,
+            bucket="test",
+            query_time="2024-05-16T10:00:00Z",
+            delta_time_start=(0, -2, 0, 0),
+            delta_time_end=(0, 1, 0, 0),
+        )
+
+    assert not filepath.exists()
+
+
+def test_query_database_raises_flux_error():
+    body = b'#datatype,string,long\r\n,error,reference\r\n,"panic: runtime error",897\r\n'
+
+    with pytest.raises(RuntimeError, match="panic: runtime error.*897"):
+        query_database(
+            client=FakeClient(body),
+            bucket="test",
+            query_time="2024-05-16T10:00:00Z",
+            delta_time_start=(0, -2, 0, 0),
+            delta_time_end=(0, 1, 0, 0),
+        )
+
+
+def test_query_database_to_file_raises_flux_error(tmp_path):
+    body = b'#datatype,string,long\r\n,error,reference\r\n,"panic: runtime error",897\r\n'
+    filepath = tmp_path / "result.parquet"
+
+    with pytest.raises(RuntimeError, match="panic: runtime error"):
+        query_database_to_file(
+            client=FakeClient(body),
+            filepath=filepath,
+            bucket="test",
+            query_time="2024-05-16T10:00:00Z",
+            delta_time_start=(0, -2, 0, 0),
+            delta_time_end=(0, 1, 0, 0),
+        )
+
+    assert not filepath.exists()
@@ -0,0 +1,90 @@
+from dataclasses import fields
+
+import pytest
+
+from database_extractor import DataExtractorQueryConfig, compile_id_filter
+from database_extractor.database_extractor import construct_flux_query, list_to_fstring
+
+
+def test_construct_flux_query():
+    query = construct_flux_query(
+        "prototype-zero",
+        "2024-05-16T08:00:00Z",
+        "2024-05-16T11:00:00Z",
+        tz_offset=-8,
+        filter='r["id"] =~ /.*/',
+        column_key="id",
+        sort_by=["_time"],
+    )
+
+    assert query.startswith('from(bucket: "prototype-zero")')
+    assert "|> range(start: 2024-05-16T08:00:00Z, stop: 2024-05-16T11:00:00Z)" in query
+    assert "|> timeShift(duration: -8h)" in query
+    assert '|> filter(fn: (r) => r["id"] =~ /.*/)' in query
+    assert '|> sort(columns: ["_time"])' in query
+
+
+def test_construct_flux_query_only_range_varies():
+    first = construct_flux_query("bucket", "2024-05-16T08:00:00Z", "2024-05-17T08:00:00Z")
+    second = construct_flux_query("bucket", "2024-05-17T08:00:00Z", "2024-05-18T08:00:00Z")
+
+    assert second == first.replace(
+        "range(start: 2024-05-16T08:00:00Z, stop: 2024-05-17T08:00:00Z)",
+        "range(start: 2024-05-17T08:00:00Z, stop: 2024-05-18T08:00:00Z)",
+    )
+
+
+def test_construct_flux_query_without_tz_offset():
+    query = construct_flux_query(
+        "bucket", "2024-05-16T08:00:00Z", "2024-05-16T11:00:00Z", tz_offset=0
+    )
+
+    assert "timeShift" not in query
+    assert "|> range(start: 2024-05-16T08:00:00Z, stop: 2024-05-16T11:00:00Z)" in query
+
+
+def test_construct_flux_query_drops_columns():
+    query = construct_flux_query(
+        "bucket",
+        "2024-05-16T08:00:00Z",
+        "2024-05-16T11:00:00Z",
+        sort_by=["_time"],
+        columns_to_drop=["_start", "_stop", "_start"],
+    )
+
+    assert query.rstrip().endswith('|> drop(columns: ["_start", "_stop"])')
+    assert query.index("|> sort(") < query.index("|> drop(")
+
+    query = construct_flux_query("bucket", "2024-05-16T08:00:00Z", "2024-05-16T11:00:00Z")
+    assert "drop(" not in query
+
+
+def test_query_config_compiles_id_filter():
+    assert compile_id_filter(["a.1", "b/2", "a.1"]) == r'r["id"] =~ /^(a\.1|b\/2)$/'
+
+    config = DataExtractorQueryConfig(column_key="id", ids=["heater_1", "heater_2"])
+
+    assert config.filter == 'r["id"] =~ /^(heater_1|heater_2)$/'
+    assert "ids" not in dict(config)
+
+
+def test_list_to_fstring_escapes_for_flux():
+    assert list_to_fstring(("_time", "_field")) == '["_time", "_field"]'
+    assert list_to_fstring(['a"b']) == '["a\\"b"]'
+    assert list_to_fstring(["a\\b", "${x}", "a\nb\x08"]) == (
+        r'["a\\b", "\${x}", "a\nb\x08"]'
+    )
+
+
+def test_query_config_mapping():
+    config = DataExtractorQueryConfig(bucket="test")
+
+    assert config._fields == tuple(field.name for field in fields(config))
+    assert config["bucket"] == "test"
+    assert config.keys() - {"bucket"} == set(config._fields) - {"bucket"}
+    assert {**config}["bucket"] == "test"
+    assert "keys" not in config
+    assert config.get("keys") is None
+    for key in ("missing", "keys", "__class__", "ids"):
+        with pytest.raises(KeyError):
+            config[key]
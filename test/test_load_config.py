@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+from database_extractor import load_config
+
+
+def test_load_config_toml(tmp_path):
+    config_path = tmp_path / "application.toml"
+    config_path.write_text('[query]\nbucket = "test"\n')
+
+    config = load_config(config_path)
+
+    assert config == {"query": {"bucket": "test"}}
+
+
+def test_load_config_returns_copy(tmp_path):
+    config_path = tmp_path / "application.toml"
+    config_path.write_text('[query]\nbucket = "test"\n')
+
+    config = load_config(str(config_path))
+    config["query"]["bucket"] = "modified"
+
+    assert load_config(str(config_path))["query"]["bucket"] == "test"
+
+
+def test_load_config_reloads_modified_file(tmp_path):
+    config_path = tmp_path / "application.toml"
+    config_path.write_text('[query]\nbucket = "test"\n')
+    assert load_config(config_path)["query"]["bucket"] == "test"
+
+    config_path.write_text('[query]\nbucket = "updated"\n')
+    mtime = os.stat(config_path).st_mtime
+    os.utime(config_path, (mtime + 10, mtime + 10))
+
+    assert load_config(config_path)["query"]["bucket"] == "updated"
+
+
+def test_load_config_yaml(tmp_path):
+    config_path = tmp_path / "logger.yaml"
+    config_path.write_text("version: 1\nhandlers:\n  console:\n    level: INFO\n")
+
+    config = load_config(config_path)
+
+    assert config == {"version": 1, "handlers": {"console": {"level": "INFO"}}}
+
+
+def test_load_config_missing_file(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        load_config(tmp_path / "missing.toml")
+
+
+def test_load_config_reloads_resized_file_with_same_mtime(tmp_path):
+    config_path = tmp_path / "application.toml"
+    config_path.write_text('[query]\nbucket = "test"\n')
+    mtime_ns = os.stat(config_path).st_mtime_ns
+    assert load_config(config_path)["query"]["bucket"] == "test"
+
+    config_path.write_text('[query]\nbucket = "longer name"\n')
+    os.utime(config_path, ns=(mtime_ns, mtime_ns))
+
+    assert load_config(config_path)["query"]["bucket"] == "longer name"
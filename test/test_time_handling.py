@@ -1,4 +1,10 @@
-from database_extractor import DeltaTime
+import copy
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from database_extractor import DeltaTime, format_time_string, parse_time_string
+from database_extractor.database_extractor import timezone_offset
 
 
 def test_deltatime_unpacking():
@@ -74,3 +80,63 @@ def test_shift_string_time():
     delta_time = DeltaTime(0, 1, 0, 0)
     shifted_time = shift_string_time(time_string, delta_time)
     assert shifted_time == "2024-05-16T11:00:00Z"
+
+
+def test_deltatime_is_immutable():
+    dt = DeltaTime(0, 2, 30, 0)
+    assert dt.to_timedelta() == timedelta(hours=2, minutes=30)
+
+    with pytest.raises(AttributeError):
+        dt.hours = 3
+
+    assert dict(copy.deepcopy(dt)) == dict(dt)
+
+
+def test_parse_time_string():
+    assert parse_time_string("2024-05-16T10:00:00Z") == datetime(2024, 5, 16, 10)
+    assert parse_time_string("2024/05/16 10:00", "%Y/%m/%d %H:%M") == datetime(
+        2024, 5, 16, 10
+    )
+    for time_string in (
+        "2024-05-16T10:00:00+02:00Z",
+        "2024-05-16T10:00+01Z",
+        "2024-05-16Z",
+        "2024-05-16 10:00:00Z",
+    ):
+        with pytest.raises(ValueError):
+            parse_time_string(time_string)
+
+
+def test_deltatime_equality():
+    assert DeltaTime(0, 1, 0, 0) == DeltaTime(hours=1)
+    assert DeltaTime(0, 1, 0, 0) != DeltaTime(0, 0, 60, 0)
+    assert DeltaTime(hours=1) == {"days": 0, "hours": 1, "minutes": 0, "seconds": 0}
+    assert len({DeltaTime(hours=1), DeltaTime(0, 1, 0, 0)}) == 1
+    assert DeltaTime(1, 2, 3, 4).astuple() == (1, 2, 3, 4)
+    assert repr(DeltaTime(hours=1)) == "DeltaTime(days=0, hours=1, minutes=0, seconds=0)"
+
+
+def test_format_time_string():
+    assert format_time_string(datetime(2024, 5, 16, 10, 0, 0, 500)) == "2024-05-16T10:00:00Z"
+    assert format_time_string(datetime(2024, 5, 16, 10, tzinfo=timezone.utc)) == (
+        "2024-05-16T10:00:00Z"
+    )
+    assert format_time_string(datetime(2024, 5, 16, 10), "%Y/%m/%d %H:%M") == (
+        "2024/05/16 10:00"
+    )
+
+
+def test_timezone_offset():
+    assert timezone_offset(datetime(2024, 3, 10)) == -8
+    assert timezone_offset(datetime(2024, 3, 11)) == -7
+    assert timezone_offset(datetime(2024, 11, 3)) == -7
+    assert timezone_offset(datetime(2024, 11, 4)) == -8
+    assert timezone_offset(datetime(2025, 7, 1)) == -7
+
+
+def test_deltatime_string_arithmetic():
+    delta_time = DeltaTime(0, 2, 0, 0)
+
+    assert delta_time + "2024-05-16T10:00:00Z" == datetime(2024, 5, 16, 12)
+    assert "2024-05-16T10:00:00Z" - delta_time == datetime(2024, 5, 16, 8)
+    assert delta_time - "2024-05-16T10:00:00Z" == datetime(2024, 5, 16, 8)